@@ -1,13 +1,16 @@
-from database import get_connection
+import sqlite3
+from pathlib import Path
 
-conn = get_connection()
-cur = conn.cursor()
+from database import DB_PATH
 
-cur.execute("SELECT username, content, timestamp FROM messages")
-rows = cur.fetchall()
+# Debug tool: open the DB read-only on its own connection instead of going through
+# the pool, so nothing (not even the pool's journal_mode PRAGMA) can write to it
+conn = sqlite3.connect(f"{Path(DB_PATH).as_uri()}?mode=ro", uri=True)
 
-print("MESSAGES IN DB:")
-for row in rows:
-    print(row)
-
-conn.close()
+try:
+    print("MESSAGES IN DB:")
+    # Iterate the cursor instead of fetchall() so memory stays flat as the table grows
+    for row in conn.execute("SELECT username, content, timestamp FROM messages"):
+        print(row)
+finally:
+    conn.close()
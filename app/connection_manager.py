@@ -1,28 +1,123 @@
-from fastapi import WebSocket
+import asyncio
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+# broadcast() only queues frames; each connection's own drain task sends them, so a
+# slow peer only delays itself. Frames still go out one send_text each (one JSON
+# document per frame). A lone frame is sent at once; only when a backlog is already
+# building do we wait FLUSH_DELAY to pick up the rest of the burst in one pass.
+FLUSH_DELAY = 0.001     # seconds to wait for more frames when several are queued
+MAX_BATCH = 32          # send right away once this many frames are queued for a peer
+SEND_TIMEOUT = 5.0      # a peer slower than this is backpressured, not dead
+
+# Errors that mean the peer is gone. Anything else still drops the peer, but is logged.
+# (Keepalive pings are handled by uvicorn: --ws-ping-interval / --ws-ping-timeout.)
+SEND_ERRORS = (WebSocketDisconnect, OSError, RuntimeError)
+
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections = []
+        # Set, not list: membership checks and removals are O(1)
+        self.active_connections: set[WebSocket] = set()
+        # Frames waiting for the next flush, in send order per connection
+        self._pending: dict[WebSocket, list[str]] = {}
+        # One drain task per connection with queued frames; a slow peer only delays itself
+        self._senders: dict[WebSocket, asyncio.Task] = {}
+        # Peers whose last send is still stuck; skipped until it drains
+        self._backpressured: set[WebSocket] = set()
+        # Newly joined peers: frames queue up but aren't sent until release()
+        self._held: set[WebSocket] = set()
 
-    def connect(self, websocket: WebSocket):
-        self.active_connections.append(websocket)
+    def connect(self, websocket: WebSocket, hold: bool = False):
+        # hold=True lets the caller send something first (chat history) while
+        # broadcasts made in the meantime are kept, not lost or sent ahead of it
+        self.active_connections.add(websocket)
+        if hold:
+            self._held.add(websocket)
         print(f"CONNECTED: {len(self.active_connections)} clients")
 
+    def release(self, websocket: WebSocket):
+        """Start delivering to a peer registered with connect(hold=True)."""
+        self._held.discard(websocket)
+        if websocket in self._pending and websocket not in self._senders:
+            self._senders[websocket] = asyncio.create_task(self._drain(websocket))
+
     def disconnect(self, websocket: WebSocket):
-        # Only remove if it exists in the list
+        self._pending.pop(websocket, None)
+        self._backpressured.discard(websocket)
+        self._held.discard(websocket)
+        # Only report if it was still registered
         if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+            self.active_connections.discard(websocket)
             print(f"DISCONNECTED: {len(self.active_connections)} clients")
 
+    async def _safe_send(self, connection: WebSocket, frames: list[str]) -> bool:
+        # False means the peer is gone; unexpected errors propagate to the flusher
+        try:
+            for frame in frames:
+                await connection.send_text(frame)
+        except SEND_ERRORS:
+            return False
+        return True
+
+    async def _send_pass(self, connection: WebSocket, frames: list[str]) -> bool:
+        # Runs inside the peer's drain task, so there is only ever one send loop per
+        # socket. The send is never cancelled (that could leave half a frame on the
+        # wire); if it outlives SEND_TIMEOUT the peer is quarantined until it finishes.
+        task = asyncio.ensure_future(self._safe_send(connection, frames))
+        done, _ = await asyncio.wait({task}, timeout=SEND_TIMEOUT)
+        if task not in done:
+            self._backpressured.add(connection)
+            try:
+                await task
+            finally:
+                self._backpressured.discard(connection)
+        return task.result()
+
+    async def _drain(self, connection: WebSocket):
+        try:
+            while True:
+                frames = self._pending.get(connection)
+                if not frames:
+                    return
+                if 1 < len(frames) < MAX_BATCH:
+                    await asyncio.sleep(FLUSH_DELAY)
+
+                # Take everything queued so far; later frames wait for the next pass
+                frames = self._pending.pop(connection, None)
+                if not frames:
+                    return
+
+                try:
+                    delivered = await self._send_pass(connection, frames)
+                except Exception as e:
+                    print(f"BROADCAST ERROR: {e!r}")
+                    delivered = False
+
+                if not delivered:
+                    self._drop(connection)
+                    return
+        finally:
+            if self._senders.get(connection) is asyncio.current_task():
+                del self._senders[connection]
+
+    def _drop(self, connection: WebSocket):
+        self._pending.pop(connection, None)
+        self._backpressured.discard(connection)
+        self.active_connections.discard(connection)
+
     async def broadcast(self, message: str):
-        dead = []
         for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except:
-                dead.append(connection)
-
-        # Remove dead connections
-        for d in dead:
-            if d in self.active_connections:
-                self.active_connections.remove(d)
\ No newline at end of file
+            if connection in self._backpressured:
+                continue
+            self._pending.setdefault(connection, []).append(message)
+            if connection not in self._senders and connection not in self._held:
+                self._senders[connection] = asyncio.create_task(self._drain(connection))
+
+    async def stop(self):
+        """Cancel every peer's drain task (called on shutdown)."""
+        senders = list(self._senders.values())
+        for task in senders:
+            task.cancel()
+        await asyncio.gather(*senders, return_exceptions=True)
+        self._senders.clear()
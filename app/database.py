@@ -1,65 +1,255 @@
 import sqlite3
 import os
+import queue
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DB_PATH = os.path.join(BASE_DIR, "chat.db")
 
+# 🔹 Connection pool settings (plain JSON-style dict so it can be loaded from config later)
+POOL_CONFIG = {
+    "min_size": 2,
+    "max_size": 10,
+    "timeout": 30,
+}
 
-def get_connection():
-    # 🔹 ADDED: row_factory for cleaner dict-style access (optional but useful)
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+# 🔹 Applied once per connection when it is opened, not on every checkout
+CONNECTION_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "temp_store=MEMORY",
+    "cache_size=-64000",
+    "mmap_size=268435456",
+)
+
+# 🔹 Hot-path SQL, defined once. (sqlite3 caches prepared statements by SQL text,
+# so this is for one source of truth, not for caching: inline literals hit it too.)
+SQL_INSERT_MSG = "INSERT INTO messages (username, content, timestamp, ts_ms) VALUES (?, ?, ?, ?)"
+SQL_SELECT_RECENT = "SELECT username, content, timestamp FROM messages ORDER BY id DESC LIMIT ?"
+
+_POOL = None            # queue.Queue[sqlite3.Connection], created by init_pool()
+_pool_size = 0          # connections currently owned by the pool (idle + checked out)
+_pool_lock = threading.Lock()
+
+# 🔹 Single read-write connection; all INSERTs go through it so writers never contend
+_WRITER = None
+_writer_lock = threading.Lock()
+
+
+def _make_connection(isolation_level=""):
+    # Plain tuples (no row_factory): callers index by position, so skip the Row wrapper
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=isolation_level)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(f"PRAGMA {pragma}")
     return conn
 
 
+def init_pool():
+    """Open the minimum number of connections up front (no-op if already open)."""
+    global _POOL, _pool_size
+    with _pool_lock:
+        if _POOL is not None:
+            return
+        _POOL = queue.Queue(maxsize=POOL_CONFIG["max_size"])
+        for _ in range(POOL_CONFIG["min_size"]):
+            _POOL.put(_make_connection())
+        _pool_size = POOL_CONFIG["min_size"]
+
+
+def close_pool():
+    """Drain the pool and close every idle connection."""
+    global _POOL, _pool_size
+    with _pool_lock:
+        if _POOL is None:
+            return
+        while True:
+            try:
+                _POOL.get_nowait().close()
+            except queue.Empty:
+                break
+        _POOL = None
+        _pool_size = 0
+
+    close_writer()
+
+
+def _acquire():
+    global _pool_size
+    if _POOL is None:
+        init_pool()
+
+    try:
+        return _POOL.get_nowait()
+    except queue.Empty:
+        pass
+
+    # Grow lazily up to max_size before making callers wait
+    with _pool_lock:
+        if _pool_size < POOL_CONFIG["max_size"]:
+            _pool_size += 1
+            grow = True
+        else:
+            grow = False
+    if grow:
+        try:
+            return _make_connection()
+        except Exception:
+            with _pool_lock:
+                _pool_size -= 1
+            raise
+
+    return _POOL.get(timeout=POOL_CONFIG["timeout"])
+
+
+def _release(conn):
+    pool = _POOL
+    if pool is None:
+        # Pool was closed while this connection was checked out
+        conn.close()
+        return
+    pool.put(conn)
+
+
+@contextmanager
+def get_connection():
+    """Check a connection out of the pool for the duration of a `with` block."""
+    global _pool_size
+    conn = _acquire()
+    try:
+        yield conn
+    except Exception:
+        # Never hand a connection with a half-finished transaction back to the pool;
+        # if it can't even roll back, it's broken, so replace it with a fresh one.
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            try:
+                conn = _make_connection()
+            except Exception:
+                # No replacement: give up the slot instead of pooling a closed handle
+                conn = None
+                with _pool_lock:
+                    _pool_size -= 1
+        raise
+    else:
+        if conn.in_transaction:
+            conn.rollback()
+    finally:
+        if conn is not None:
+            _release(conn)
+
+
+def close_writer():
+    global _WRITER
+    with _writer_lock:
+        if _WRITER is not None:
+            _WRITER.close()
+            _WRITER = None
+
+
+@contextmanager
+def get_write_connection():
+    """Hold the dedicated write connection for the duration of a `with` block."""
+    global _WRITER
+    with _writer_lock:
+        if _WRITER is None:
+            # Autocommit mode: save_messages() opens and commits its own transactions
+            _WRITER = _make_connection(isolation_level=None)
+        conn = _WRITER
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                conn.close()
+                _WRITER = None
+            raise
+        else:
+            if conn.in_transaction:
+                conn.rollback()
+
+
+def ms_to_iso(ts_ms):
+    """Unix milliseconds → naive UTC ISO-8601 string, the format clients already get."""
+    return datetime.fromtimestamp(ts_ms / 1000, timezone.utc).replace(tzinfo=None).isoformat()
+
+
 def init_db():
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # 🔹 USERS TABLE (unchanged, correct)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL
-        )
-    """)
-
-    # 🔹 MESSAGES TABLE (minor refinements)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL,
-            content TEXT NOT NULL,
-            timestamp TEXT NOT NULL
-        )
-    """)
-
-    conn.commit()
-    conn.close()
-    print("Database initialized at:", DB_PATH)
+    init_pool()
 
+    with get_write_connection() as conn:
+        cursor = conn.cursor()
 
-def get_last_messages(limit=50):
-    conn = get_connection()
-    cursor = conn.cursor()
+        # Schema + migration in one transaction (the writer is in autocommit mode),
+        # so a crash can't leave ts_ms added but never backfilled
+        cursor.execute("BEGIN IMMEDIATE")
 
-    cursor.execute("""
-        SELECT username, content, timestamp
-        FROM messages
-        ORDER BY id DESC
-        LIMIT ?
-    """, (limit,))
+        # 🔹 USERS TABLE (unchanged, correct)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL
+            )
+        """)
 
-    rows = cursor.fetchall()
-    conn.close()
+        # 🔹 MESSAGES TABLE (minor refinements)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                ts_ms INTEGER
+            )
+        """)
 
-    # 🔹 CHANGED: return JSON-ready dicts, not raw tuples
+        # 🔹 MIGRATION: integer unix-millis timestamps (old databases lack ts_ms).
+        # The TEXT column is still written until every reader has moved over.
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(messages)")}
+        if "ts_ms" not in columns:
+            cursor.execute("ALTER TABLE messages ADD COLUMN ts_ms INTEGER")
+            cursor.execute("""
+                UPDATE messages
+                SET ts_ms = CAST(ROUND((julianday(timestamp) - 2440587.5) * 86400000) AS INTEGER)
+                WHERE ts_ms IS NULL
+            """)
+
+        cursor.execute("COMMIT")
+    print("Database initialized at:", DB_PATH)
+
+
+def get_last_messages(limit=50):
+    with get_connection() as conn:
+        # 🔹 NOTE: messages is a rowid table, so this walks the table B-tree backwards
+        # ("SCAN messages", no temp sort) and the columns are read from the same page.
+        # A separate (id DESC, ...) covering index would only duplicate the table.
+        rows = conn.execute(SQL_SELECT_RECENT, (limit,)).fetchall()
+
+    # 🔹 CHANGED: return JSON-ready dicts, not raw tuples.
+    # The stored TEXT is sent as-is: backfilled ts_ms values are rounded to the
+    # millisecond, so rebuilding the string from ts_ms would alter old timestamps.
     return [
         {
-            "username": row["username"],
-            "content": row["content"],
-            "timestamp": row["timestamp"]
+            "username": username,
+            "content": content,
+            "timestamp": timestamp
         }
-        for row in reversed(rows)
+        for username, content, timestamp in reversed(rows)
     ]
+
+
+def save_messages(batch):
+    """Insert a batch of (username, content, timestamp, ts_ms) rows in one transaction.
+
+    On error the transaction is rolled back by get_write_connection() and the
+    exception propagates, so the caller can retry the whole batch.
+    """
+    with get_write_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(SQL_INSERT_MSG, batch)
+        conn.execute("COMMIT")
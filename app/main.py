@@ -1,15 +1,23 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime
+from collections import OrderedDict, deque
+import asyncio
+import time
 import uuid
-import json
+import orjson
 import logging
 
 from connection_manager import ConnectionManager
-from database import init_db, get_connection, get_last_messages
+from database import init_db, close_pool, get_connection, get_write_connection, get_last_messages, save_messages, ms_to_iso
 from models import UserRegister, UserLogin
 from security import hash_password, verify_password
 
+# 🔹 SQL used by the auth and stats endpoints
+SQL_INSERT_USER = "INSERT INTO users (username, password_hash) VALUES (?, ?)"
+SQL_SELECT_HASH = "SELECT password_hash FROM users WHERE username = ?"
+SQL_COUNT_USERS = "SELECT COUNT(*) FROM users"
+SQL_COUNT_MESSAGES = "SELECT COUNT(*) FROM messages"
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -30,14 +38,150 @@ app.add_middleware(
 )
 
 manager = ConnectionManager()
-sessions = {}  # token → username
+
+# 🔹 Sessions live in a bounded LRU: token → (username, expires_at on the monotonic clock)
+MAX_SESSIONS = 100_000
+SESSION_TTL = 24 * 60 * 60  # seconds
+sessions: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+
+
+def create_session(username: str) -> str:
+    token = str(uuid.uuid4())
+    sessions[token] = (username, time.monotonic() + SESSION_TTL)
+    # Evict the least recently used sessions once over the cap
+    while len(sessions) > MAX_SESSIONS:
+        sessions.popitem(last=False)
+    return token
+
+
+def get_session_user(token: str):
+    """Return the username for a live token (marking it recently used), else None."""
+    entry = sessions.get(token)
+    if entry is None:
+        return None
+
+    username, expires_at = entry
+    if time.monotonic() >= expires_at:
+        sessions.pop(token, None)
+        return None
+
+    sessions.move_to_end(token)
+    return username
+
+# 🔹 Messages are persisted off the hot path: the WebSocket loop enqueues them and a
+# single background task writes whatever has piled up in one executemany/commit.
+WRITE_BATCH_SIZE = 256
+WRITE_QUEUE_SIZE = 10000
+WRITE_RETRIES = 3  # attempts per batch before it is logged and dropped
+_write_queue = None  # asyncio.Queue of (username, content, timestamp, ts_ms), None = stop; made on startup
+_writer_task = None
+
+
+# 🔹 /stats row counts: recounted at most every STATS_TTL seconds and bumped in
+# place by our own writes in between, so the endpoint never scans per request
+STATS_TTL = 5.0
+_stats_cache = {"users": 0, "messages": 0, "t": None}
+
+
+# 🔹 Chat history is served from memory: the last HISTORY_LIMIT broadcast messages,
+# seeded from the DB on startup and appended in the same synchronous step as
+# broadcast(). A message is therefore in history as soon as anyone can receive it,
+# whether or not the writer has saved it yet. The encoded frame is shared by every
+# joiner until the next message arrives.
+HISTORY_LIMIT = 50
+_recent_messages = deque(maxlen=HISTORY_LIMIT)
+_history_payload = None  # cached JSON text of the history frame; None = rebuild
+
+
+def _remember(message: dict):
+    global _history_payload
+    _recent_messages.append(message)
+    _history_payload = None
+
+
+def get_history_payload() -> str:
+    global _history_payload
+    if _history_payload is None:
+        _history_payload = orjson.dumps({
+            "type": "history",
+            "messages": list(_recent_messages)
+        }).decode()
+    return _history_payload
+
+
+def _count(sql: str) -> int:
+    with get_connection() as conn:
+        return conn.execute(sql).fetchone()[0]
+
+
+def _bump_stats(key: str, n: int = 1):
+    if _stats_cache["t"] is not None:
+        _stats_cache[key] += n
+
+
+async def _writer_loop():
+    stop = False
+    while not stop:
+        item = await _write_queue.get()
+        if item is None:
+            break
+
+        batch = [item]
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                item = _write_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+
+        # Retry the rolled-back batch in place rather than re-queueing it, so rows
+        # never land out of order behind newer messages
+        for attempt in range(1, WRITE_RETRIES + 1):
+            try:
+                await asyncio.to_thread(save_messages, batch)
+                _bump_stats("messages", len(batch))
+                break
+            except Exception as e:
+                if attempt == WRITE_RETRIES:
+                    logger.error(f"❌ Database error saving {len(batch)} message(s), dropping batch: {e}")
+                else:
+                    logger.warning(f"⚠️ Database error saving {len(batch)} message(s), retrying: {e}")
+                    await asyncio.sleep(0.05 * attempt)
+
+
+async def send_json(websocket: WebSocket, data):
+    # orjson instead of Starlette's stdlib-json send_json; still a text frame for clients
+    await websocket.send_text(orjson.dumps(data).decode())
+
+
+async def receive_frame(websocket: WebSocket):
+    """Next frame's raw payload: bytes for binary frames, str for text frames.
+
+    orjson.loads takes either, so binary frames skip the str decode entirely and
+    text frames (what the bundled clients send) work unchanged.
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    raw = message.get("bytes")
+    return raw if raw is not None else message.get("text", "")
 
 
 # -------------------- STARTUP --------------------
 @app.on_event("startup")
-def startup():
+async def startup():
+    global _write_queue, _writer_task, _history_payload
     try:
         init_db()
+        _recent_messages.clear()
+        _recent_messages.extend(get_last_messages(HISTORY_LIMIT))
+        _history_payload = None
+        # Created here so it belongs to the server's running event loop
+        _write_queue = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+        _writer_task = asyncio.create_task(_writer_loop())
         logger.info("✅ Server started successfully")
     except Exception as e:
         logger.error(f"❌ Failed to initialize database: {e}")
@@ -45,18 +189,37 @@ def startup():
 
 
 @app.on_event("shutdown")
-def shutdown():
+async def shutdown():
+    # Let the writer flush everything queued before it, then close the pool
+    if _writer_task is not None:
+        await _write_queue.put(None)
+        await _writer_task
+    await manager.stop()
+    close_pool()
     logger.info("🔴 Server shutting down")
 
 
 # -------------------- AUTH --------------------
+# Blocking work (hashing + SQLite) for each auth request runs in one worker-thread
+# hop via asyncio.to_thread, so the endpoints themselves stay on the event loop.
+def _insert_user(username: str, password: str):
+    password_hash = hash_password(password)
+    with get_write_connection() as conn:
+        # Single statement on the autocommit write connection: commits on its own
+        conn.execute(SQL_INSERT_USER, (username, password_hash))
+
+
+def _check_credentials(username: str, password: str) -> bool:
+    with get_connection() as conn:
+        row = conn.execute(SQL_SELECT_HASH, (username,)).fetchone()
+
+    return row is not None and verify_password(password, row[0])
+
+
 @app.post("/register", tags=["Authentication"])
-def register(user: UserRegister):
+async def register(user: UserRegister):
     """Register a new user account"""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-
         # Validate username
         if len(user.username) < 3:
             raise HTTPException(status_code=400, detail="Username must be at least 3 characters")
@@ -64,11 +227,8 @@ def register(user: UserRegister):
         if len(user.password) < 6:
             raise HTTPException(status_code=400, detail="Password must be at least 6 characters")
 
-        cur.execute(
-            "INSERT INTO users (username, password_hash) VALUES (?, ?)",
-            (user.username, hash_password(user.password))
-        )
-        conn.commit()
+        await asyncio.to_thread(_insert_user, user.username, user.password)
+        _bump_stats("users")
         logger.info(f"✅ New user registered: {user.username}")
         
     except HTTPException:
@@ -76,32 +236,19 @@ def register(user: UserRegister):
     except Exception as e:
         logger.error(f"❌ Registration failed for {user.username}: {e}")
         raise HTTPException(status_code=400, detail="User already exists")
-    finally:
-        conn.close()
 
     return {"message": "User registered successfully"}
 
 
 @app.post("/login", tags=["Authentication"])
-def login(user: UserLogin):
+async def login(user: UserLogin):
     """Authenticate user and receive access token"""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-
-        cur.execute(
-            "SELECT password_hash FROM users WHERE username = ?",
-            (user.username,)
-        )
-        row = cur.fetchone()
-        conn.close()
-
-        if not row or not verify_password(user.password, row[0]):
+        if not await asyncio.to_thread(_check_credentials, user.username, user.password):
             logger.warning(f"⚠️ Failed login attempt for: {user.username}")
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
-        token = str(uuid.uuid4())
-        sessions[token] = user.username
+        token = create_session(user.username)
         
         logger.info(f"✅ User logged in: {user.username}")
         return {"token": token}
@@ -134,87 +281,72 @@ async def websocket_endpoint(
     """WebSocket endpoint for real-time chat"""
     
     # 🔒 AUTH CHECK
-    if token not in sessions:
+    username = get_session_user(token)
+    if username is None:
         logger.warning(f"⚠️ Unauthorized WebSocket connection attempt with token: {token[:8]}...")
         await websocket.close(code=1008, reason="Unauthorized")
         return
-
-    username = sessions[token]
     
     try:
         await websocket.accept()
-        manager.connect(websocket)
+        # Snapshot history and register with no await in between: every message is
+        # either in the snapshot or queued for this socket, never both or neither.
+        # The socket is held until the history frame is out, so live frames can't
+        # arrive ahead of it.
+        history = get_history_payload()
+        manager.connect(websocket, hold=True)
         logger.info(f"🔌 {username} connected. Total connections: {len(manager.active_connections)}")
 
         # 🔹 SEND CHAT HISTORY
         try:
-            history = get_last_messages(limit=50)
-            await websocket.send_json({
-                "type": "history",
-                "messages": history
-            })
-            logger.debug(f"📜 Sent {len(history)} messages to {username}")
+            await websocket.send_text(history)
+            logger.debug(f"📜 Sent chat history to {username}")
         except Exception as e:
             logger.error(f"❌ Failed to send history to {username}: {e}")
+        finally:
+            manager.release(websocket)
 
         # 🔹 MAIN MESSAGE LOOP
         while True:
             try:
-                raw = await websocket.receive_text()
+                raw = await receive_frame(websocket)
 
                 # 🔹 VALIDATE MESSAGE FORMAT
                 try:
-                    data = json.loads(raw)
+                    data = orjson.loads(raw)
                     content = data.get("content", "").strip()
                     
                     if not content:
-                        await websocket.send_json({
+                        await send_json(websocket, {
                             "type": "error",
                             "detail": "Message cannot be empty"
                         })
                         continue
                     
                     if len(content) > 5000:
-                        await websocket.send_json({
+                        await send_json(websocket, {
                             "type": "error",
                             "detail": "Message too long (max 5000 characters)"
                         })
                         continue
                         
-                except json.JSONDecodeError:
+                except orjson.JSONDecodeError:
                     logger.warning(f"⚠️ Invalid JSON from {username}")
-                    await websocket.send_json({
+                    await send_json(websocket, {
                         "type": "error",
                         "detail": "Invalid message format"
                     })
                     continue
                 except Exception as e:
                     logger.error(f"❌ Message validation error: {e}")
-                    await websocket.send_json({
+                    await send_json(websocket, {
                         "type": "error",
                         "detail": "Invalid message format"
                     })
                     continue
 
-                timestamp = datetime.utcnow().isoformat()
-
-                # 🔹 SAVE MESSAGE
-                try:
-                    conn = get_connection()
-                    cur = conn.cursor()
-                    cur.execute(
-                        "INSERT INTO messages (username, content, timestamp) VALUES (?, ?, ?)",
-                        (username, content, timestamp)
-                    )
-                    conn.commit()
-                    conn.close()
-                except Exception as e:
-                    logger.error(f"❌ Database error saving message from {username}: {e}")
-                    await websocket.send_json({
-                        "type": "error",
-                        "detail": "Failed to save message"
-                    })
-                    continue
+                ts_ms = time.time_ns() // 1_000_000
+                timestamp = ms_to_iso(ts_ms)
 
                 # 🔹 BROADCAST MESSAGE
                 message_data = {
@@ -225,11 +357,17 @@ async def websocket_endpoint(
                 }
                 
                 try:
-                    await manager.broadcast(json.dumps(message_data))
+                    # No await between these two: see _recent_messages
+                    _remember({"username": username, "content": content, "timestamp": timestamp})
+                    await manager.broadcast(orjson.dumps(message_data).decode())
                     logger.debug(f"📤 {username}: {content[:50]}...")
                 except Exception as e:
                     logger.error(f"❌ Broadcast error: {e}")
 
+                # 🔹 SAVE MESSAGE (persisted in batches by _writer_loop; history doesn't
+                # wait for this, it already has the message via _remember above)
+                await _write_queue.put((username, content, timestamp, ts_ms))
+
             except WebSocketDisconnect:
                 logger.info(f"👋 {username} disconnected (normal)")
                 break
@@ -251,20 +389,17 @@ async def websocket_endpoint(
 async def get_stats():
     """Get server statistics"""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        
-        cur.execute("SELECT COUNT(*) FROM users")
-        total_users = cur.fetchone()[0]
-        
-        cur.execute("SELECT COUNT(*) FROM messages")
-        total_messages = cur.fetchone()[0]
-        
-        conn.close()
+        now = time.monotonic()
+        if _stats_cache["t"] is None or now - _stats_cache["t"] >= STATS_TTL:
+            total_users, total_messages = await asyncio.gather(
+                asyncio.to_thread(_count, SQL_COUNT_USERS),
+                asyncio.to_thread(_count, SQL_COUNT_MESSAGES)
+            )
+            _stats_cache.update(users=total_users, messages=total_messages, t=now)
         
         return {
-            "total_users": total_users,
-            "total_messages": total_messages,
+            "total_users": _stats_cache["users"],
+            "total_messages": _stats_cache["messages"],
             "active_connections": len(manager.active_connections),
             "active_sessions": len(sessions)
         }
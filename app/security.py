@@ -3,5 +3,7 @@ import hashlib
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
+# No verification cache: with a single SHA-256 the check costs about as much as
+# computing a cache key would. Revisit if this moves to a slow KDF (bcrypt/Argon2).
 def verify_password(password: str, hashed: str) -> bool:
     return hash_password(password) == hashed
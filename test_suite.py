@@ -297,6 +297,44 @@ async def test_concurrent_connections(token1, token2):
         print_test("Concurrent connections", False, f"Error: {e}")
         return False
 
+async def test_history_includes_latest_message(token):
+    """Test that a client joining right after a broadcast sees it in history"""
+    print_section("TEST: History After Broadcast")
+    
+    try:
+        uri = f"{WS_URL}?token={token}"
+        async with websockets.connect(uri) as ws1:
+            await ws1.recv()
+            
+            # Join immediately after the broadcast, before the server's batched
+            # writer has necessarily saved the message
+            test_content = f"History check at {datetime.now().isoformat()}"
+            await ws1.send(json.dumps({"content": test_content}))
+            live = json.loads(await asyncio.wait_for(ws1.recv(), timeout=5.0))
+            
+            async with websockets.connect(uri) as ws2:
+                history = json.loads(await asyncio.wait_for(ws2.recv(), timeout=5.0))
+                messages = history.get("messages", [])
+                contents = [m["content"] for m in messages]
+                passed = history.get("type") == "history" and contents.count(test_content) == 1
+                print_test("New client sees latest message once", passed, f"Content: {test_content}")
+                
+                # Every history timestamp (including rows migrated from older
+                # databases) must be ISO-8601, and match what was broadcast live
+                try:
+                    for m in messages:
+                        datetime.fromisoformat(m["timestamp"])
+                    stored = [m["timestamp"] for m in messages if m["content"] == test_content]
+                    passed2 = stored == [live.get("timestamp")]
+                except (KeyError, TypeError, ValueError):
+                    passed2 = False
+                print_test("History timestamps are ISO-8601", passed2, f"Live: {live.get('timestamp')}")
+                return passed and passed2
+            
+    except Exception as e:
+        print_test("History after broadcast", False, f"Error: {e}")
+        return False
+
 # ============================================
 # MAIN TEST RUNNER
 # ============================================
@@ -361,6 +399,11 @@ async def run_all_tests():
     else:
         results["failed"] += 1
     
+    if await test_history_includes_latest_message(token):
+        results["passed"] += 1
+    else:
+        results["failed"] += 1
+    
     # Print summary
     print_section("TEST SUMMARY")
     total = results["passed"] + results["failed"]